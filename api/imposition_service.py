@@ -1,18 +1,98 @@
 # Nombre del archivo: imposition_service.py
 # ESTADO: CORREGIDO
 
+import hashlib
+import io
+import threading
+from collections import OrderedDict
 import fitz  # PyMuPDF
-from typing import List, Dict, Any
-import base64
+import numpy as np
+from typing import List, Dict, Any, Optional
+import pybase64
 import traceback
 import logging
 
 # Configuramos el logging para que sea simple y se muestre en Vercel
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
-def validate_and_preview_pdf(pdf_content: bytes, expected_width: float, expected_height: float, bleed_mm: float) -> Dict:
+# Conversión entre milímetros y puntos PDF (1 pulgada = 72 puntos = 25.4 mm)
+MM_TO_PT = 72.0 / 25.4
+PT_TO_MM = 25.4 / 72.0
+
+# Cantidad de placements estampados entre cada liberación del store de MuPDF
+STORE_SHRINK_CHUNK = 50
+
+# Distancia (pt) al borde del pliego por debajo de la cual una coordenada de corte no lleva marca
+EDGE_EPS_PT = 0.5
+
+# Prefijo del data URI de la previsualización, en bytes para unirlo al base64 sin pasar por str
+_JPEG_DATA_URI_PREFIX = b"data:image/jpeg;base64,"
+
+# Caché LRU de resultados de previsualización: el front vuelve a pedir la misma previsualización
+# en cada cambio del formulario con el mismo archivo
+PREVIEW_CACHE_SIZE = 32
+_preview_cache: "OrderedDict[tuple, Dict]" = OrderedDict()
+_preview_cache_lock = threading.Lock()
+
+# Mensaje devuelto ante errores inesperados (estos resultados no se guardan en la caché)
+_PREVIEW_INTERNAL_ERROR = "Error interno del servidor al procesar el PDF."
+
+# Matriz de rotación de la previsualización, construida una sola vez al cargar el módulo
+_MAT_ROT_90 = fitz.Matrix(90)
+
+# Lado mayor máximo de la previsualización en píxeles (a 72 dpi 1 pt = 1 px; los formatos grandes se reducen)
+PREVIEW_MAX_SIDE_PX = 600
+
+def _dims_match(width: float, height: float, expected_width: float, expected_height: float, tolerance: float = 1.0) -> bool:
+    """Compara unas dimensiones con las esperadas, tanto sin rotar como rotadas, en una única operación NumPy."""
+    dims = np.array([width, height])
+    expected = np.array([expected_width, expected_height])
+    return bool((np.abs(dims - expected) < tolerance).all() or (np.abs(dims - expected[::-1]) < tolerance).all())
+
+def _render_preview_data_uri(page: fitz.Page, clip: fitz.Rect, matrix: fitz.Matrix, colorspace: fitz.Colorspace) -> str:
+    """
+    Renderiza la previsualización y la devuelve como data URI JPEG en base64.
+    El pixmap y el JPEG se liberan antes de volver y se vacía el store de MuPDF,
+    para que la memoria del proceso no crezca con cada petición.
+    """
+    pix = page.get_pixmap(matrix=matrix, clip=clip, alpha=False, colorspace=colorspace)
+    # JPEG se codifica bastante más rápido que PNG y genera un payload base64 más liviano
+    img_bytes = pix.tobytes(output="jpeg", jpg_quality=75)
+    del pix
+    # pybase64 (SIMD) codifica a bytes; se concatena con el prefijo y se decodifica una sola vez
+    # (el base64 es ASCII puro, así que decode('ascii') toma el camino rápido de CPython)
+    data_uri = (_JPEG_DATA_URI_PREFIX + pybase64.b64encode(img_bytes)).decode('ascii')
+    del img_bytes
+    fitz.TOOLS.store_shrink(100)
+    return data_uri
+
+def validate_and_preview_pdf(pdf_content: bytes, expected_width: float, expected_height: float, bleed_mm: float, render_preview: bool = True, grayscale: bool = False) -> Dict:
+    """
+    Igual que _validate_and_preview_pdf_uncached, pero reutiliza el resultado si ya se procesó
+    el mismo contenido (hash blake2b) con los mismos parámetros.
+    """
+    key = (hashlib.blake2b(pdf_content, digest_size=16).digest(), expected_width, expected_height, bleed_mm, render_preview, grayscale)
+    with _preview_cache_lock:
+        cached = _preview_cache.get(key)
+        if cached is not None:
+            _preview_cache.move_to_end(key)
+            logging.info("Previsualización obtenida de la caché.")
+            return dict(cached)
+
+    result = _validate_and_preview_pdf_uncached(pdf_content, expected_width, expected_height, bleed_mm, render_preview, grayscale)
+    if result.get("errorMessage") != _PREVIEW_INTERNAL_ERROR:
+        with _preview_cache_lock:
+            _preview_cache[key] = result
+            _preview_cache.move_to_end(key)
+            if len(_preview_cache) > PREVIEW_CACHE_SIZE:
+                _preview_cache.popitem(last=False)
+    return dict(result)
+
+def _validate_and_preview_pdf_uncached(pdf_content: bytes, expected_width: float, expected_height: float, bleed_mm: float, render_preview: bool = True, grayscale: bool = False) -> Dict:
     """
     Valida las dimensiones del TrimBox de un PDF y genera una imagen de previsualización.
+    Con render_preview=False solo se valida, sin renderizar ni codificar la imagen.
+    Con grayscale=True la previsualización se genera en escala de grises (1 byte por píxel).
     """
     try:
         logging.info("Iniciando validación de PDF...")
@@ -28,9 +108,9 @@ def validate_and_preview_pdf(pdf_content: bytes, expected_width: float, expected
             if not trimbox:
                 raise ValueError("El PDF no contiene un TrimBox definido.")
             
-            # Conversión de puntos a mm (1 pulgada = 72 puntos = 25.4 mm)
-            pdf_width_mm = trimbox.width * (25.4 / 72)
-            pdf_height_mm = trimbox.height * (25.4 / 72)
+            # Conversión de puntos a mm
+            pdf_width_mm = trimbox.width * PT_TO_MM
+            pdf_height_mm = trimbox.height * PT_TO_MM
             logging.info(f"TrimBox detectado en PDF: {pdf_width_mm:.2f}x{pdf_height_mm:.2f} mm")
 
             ### CORRECCIÓN 1: CÁLCULO EXPLÍCITO Y CORRECTO DEL TRIMBOX ESPERADO ###
@@ -45,15 +125,7 @@ def validate_and_preview_pdf(pdf_content: bytes, expected_width: float, expected
             # Esto asegura que el PDF original (p. ej. 100x150) coincida con el placement rotado (150x100).
             tolerance = 1.0  # Tolerancia de 1mm para la comparación
 
-            # Comprobación 1: Coincidencia directa (sin rotar)
-            match_as_is = (abs(pdf_width_mm - expected_trim_width) < tolerance and
-                           abs(pdf_height_mm - expected_trim_height) < tolerance)
-
-            # Comprobación 2: Coincidencia rotada
-            match_rotated = (abs(pdf_width_mm - expected_trim_height) < tolerance and
-                             abs(pdf_height_mm - expected_trim_width) < tolerance)
-
-            if not (match_as_is or match_rotated):
+            if not _dims_match(pdf_width_mm, pdf_height_mm, expected_trim_width, expected_trim_height, tolerance):
                 error_msg = f"Las dimensiones del TrimBox del PDF ({pdf_width_mm:.1f}x{pdf_height_mm:.1f}mm) no coinciden con las esperadas para el placement ({expected_trim_width:.1f}x{expected_trim_height:.1f}mm)."
                 logging.warning(f"Validación fallida: {error_msg}")
                 # Se devuelve un diccionario claro para que el front-end pueda mostrar el error.
@@ -61,6 +133,9 @@ def validate_and_preview_pdf(pdf_content: bytes, expected_width: float, expected
             
             logging.info("Validación de dimensiones exitosa.")
 
+            if not render_preview:
+                return {"isValid": True}
+
             # La lógica de previsualización y rotación de la imagen ya era correcta.
             rotation_angle = 0
             is_original_landscape = trimbox.width > trimbox.height
@@ -70,145 +145,271 @@ def validate_and_preview_pdf(pdf_content: bytes, expected_width: float, expected
             
             logging.info(f"Rotación necesaria para la previsualización: {rotation_angle} grados.")
             
-            mat = fitz.Matrix().prerotate(rotation_angle)
-            pix = page.get_pixmap(dpi=72, clip=trimbox, matrix=mat)
+            # La escala va en la matriz (get_pixmap ignora la matriz si también recibe dpi=)
+            scale = min(1.0, PREVIEW_MAX_SIDE_PX / max(trimbox.width, trimbox.height))
+            mat = fitz.Matrix(scale, scale)
+            if rotation_angle:
+                mat = mat * _MAT_ROT_90
+            # Sin canal alfa: la previsualización es opaca y así se renderizan y codifican menos bytes por píxel
+            colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+            preview_uri = _render_preview_data_uri(page, trimbox, mat, colorspace)
             logging.info("Previsualización de imagen generada.")
-            
-            img_bytes = pix.tobytes("png")
-            base64_img = base64.b64encode(img_bytes).decode('utf-8')
 
             return {
                 "isValid": True,
-                "previewImage": f"data:image/png;base64,{base64_img}"
+                "previewImage": preview_uri
             }
 
     except Exception as e:
         tb_str = traceback.format_exc()
         logging.error(f"--- ERROR INESPERADO EN validate_and_preview_pdf ---\n{tb_str}\n--------------------")
         # Devuelve un mensaje genérico para no exponer detalles internos en producción.
-        return {"isValid": False, "errorMessage": f"Error interno del servidor al procesar el PDF."}
+        return {"isValid": False, "errorMessage": _PREVIEW_INTERNAL_ERROR}
+
 
+def _validate_job_pdf(job: Dict, trim_box: Optional[fitz.Rect]) -> Optional[str]:
+    """
+    Valida el TrimBox ya leído del PDF de un trabajo (None si el PDF no tiene páginas) contra
+    las dimensiones esperadas. Devuelve el mensaje de error, o None si el PDF es válido.
+    """
+    job_name = job['job_name']
+    expected_dims = job['trim_box']
+    if trim_box is None: return f"El PDF para '{job_name}' está vacío."
+    if not trim_box: return f"El PDF para '{job_name}' no contiene un TrimBox definido."
+    width_mm, height_mm = trim_box.width * PT_TO_MM, trim_box.height * PT_TO_MM
+    expected_width, expected_height = expected_dims['width'], expected_dims['height']
+    if not _dims_match(width_mm, height_mm, expected_width, expected_height):
+        return f"Las dimensiones del PDF para '{job_name}' ({width_mm:.1f}x{height_mm:.1f}mm) no coinciden con las esperadas ({expected_width}x{expected_height}mm)."
+    return None
+
+
+def placements_to_rects(placements_pt: np.ndarray, x_offset: float, y_offset: float) -> np.ndarray:
+    """
+    Convierte un array (N, 4) de placements [x, y, ancho, largo] en puntos a rects [x0, y0, x1, y1]
+    desplazados por el centrado del pliego, todo en una sola operación vectorizada.
+    """
+    x0 = placements_pt[:, 0] + x_offset
+    y0 = placements_pt[:, 1] + y_offset
+    return np.column_stack((x0, y0, x0 + placements_pt[:, 2], y0 + placements_pt[:, 3]))
 
-def validate_and_create_imposition(sheet_config: Dict, jobs: List, job_files: Dict) -> bytes:
-    # Esta función no se modifica, ya que el problema está en la validación previa.
-    # Se incluye para mantener el archivo completo.
+
+def _merge_coords(coords: np.ndarray, tolerance: float = 0.01) -> np.ndarray:
+    """
+    Ordena y deduplica las coordenadas de corte (np.unique, en C) y fusiona las que están a menos
+    de `tolerance` puntos (~3.5 µm), para que bordes compartidos con ruido de coma flotante generen una sola marca.
+    """
+    coords = np.unique(coords)
+    if coords.size == 0:
+        return coords
+    keep = np.concatenate(([True], np.diff(coords) > tolerance))
+    return coords[keep]
+
+
+def _hash_pdf_source(source) -> bytes:
+    """Hash del contenido de un PDF dado como bytes o como ruta; los archivos se leen en bloques de 64 KB."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.blake2b(source, digest_size=16).digest()
+    digest = hashlib.blake2b(digest_size=16)
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _open_pdf_source(source) -> fitz.Document:
+    """Abre un PDF dado como bytes o como ruta; desde disco MuPDF lo lee sin copiarlo a memoria de Python."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source, filetype="pdf")
+
+
+def validate_and_create_imposition(sheet_config: Dict, jobs: List, job_files: Dict, out_doc: Optional[fitz.Document] = None) -> Optional[io.BytesIO]:
+    """
+    Valida los PDFs de los trabajos e impone sus placements en un pliego.
+    job_files mapea cada job_name al contenido del PDF (bytes) o a la ruta de un archivo en disco.
+    Si se recibe out_doc, el pliego se agrega como una página nueva de ese documento y se devuelve None
+    (quien llama lo guarda al final del lote); si no, se devuelve un BytesIO (ya rebobinado) con el PDF nuevo.
+    """
     # 1. Validación de Dimensiones
+    # Cada PDF se abre una única vez y el documento se reutiliza en la validación y el estampado.
+    # Los documentos se indexan por hash de contenido: archivos idénticos (p. ej. variantes del mismo
+    # arte con distinto nombre) comparten un único fitz.Document.
+    opened, trimboxes, job_hashes = {}, {}, {}
     try: 
         for job in jobs:
             job_name = job['job_name']
-            expected_dims = job['trim_box']
             if job_name not in job_files: raise ValueError(f"Falta el archivo PDF para el trabajo: {job_name}")
-            pdf_content = job_files[job_name]
-            with fitz.open(stream=pdf_content, filetype="pdf") as doc:
-                if not doc or len(doc) == 0: raise ValueError(f"El PDF para '{job_name}' está vacío.")
-                page = doc[0]
-                trim_box = page.trimbox
-                if not trim_box: raise ValueError(f"El PDF para '{job_name}' no contiene un TrimBox definido.")
-                width_mm, height_mm = trim_box.width * (25.4 / 72), trim_box.height * (25.4 / 72)
-                expected_width, expected_height = expected_dims['width'], expected_dims['height']
-                match_as_is = abs(width_mm - expected_width) < 1 and abs(height_mm - expected_height) < 1
-                match_rotated = abs(width_mm - expected_height) < 1 and abs(height_mm - expected_width) < 1
-                if not (match_as_is or match_rotated):
-                    raise ValueError(f"Las dimensiones del PDF para '{job_name}' ({width_mm:.1f}x{height_mm:.1f}mm) no coinciden con las esperadas ({expected_width}x{expected_height}mm).")
+            if job_name not in job_hashes:
+                pdf_hash = _hash_pdf_source(job_files[job_name])
+                job_hashes[job_name] = pdf_hash
+                if pdf_hash not in opened:
+                    doc = _open_pdf_source(job_files[job_name])
+                    opened[pdf_hash] = doc
+                    # Copia del TrimBox de la primera página, compartida por la validación y el estampado
+                    trimboxes[pdf_hash] = doc[0].trimbox if len(doc) > 0 else None
+
+        # Se validan todos los trabajos y se informan juntos todos los errores encontrados
+        errors = [err for err in (_validate_job_pdf(job, trimboxes[job_hashes[job['job_name']]]) for job in jobs) if err]
+        if errors: raise ValueError(" ".join(errors))
 
         # 2. CÁLCULO DE CENTRADO Y CREACIÓN DEL PLIEGO
-        max_x_pt, max_y_pt = 0, 0
-        for job in jobs:
-            for pos in job['placements']:
-                x_pt = pos['x'] * (72 / 25.4)
-                y_pt = pos['y'] * (72 / 25.4)
-                width_pt = pos['width'] * (72 / 25.4)
-                length_pt = pos['length'] * (72 / 25.4)
-                if (x_pt + width_pt) > max_x_pt: max_x_pt = x_pt + width_pt
-                if (y_pt + length_pt) > max_y_pt: max_y_pt = y_pt + length_pt
-
-        sheet_width_pt = sheet_config['width'] * (72 / 25.4)
-        sheet_height_pt = sheet_config['length'] * (72 / 25.4)
+        # Placements [x, y, ancho, largo] de cada trabajo convertidos a puntos una sola vez;
+        # se reutilizan en el centrado y en el estampado
+        placements_pt_by_job = [
+            np.array([[p['x'], p['y'], p['width'], p['length']] for p in job['placements']], dtype=np.float64).reshape(-1, 4) * MM_TO_PT
+            for job in jobs
+        ]
+        all_placements_pt = np.concatenate(placements_pt_by_job) if placements_pt_by_job else np.empty((0, 4))
+        if len(all_placements_pt):
+            max_x_pt = float((all_placements_pt[:, 0] + all_placements_pt[:, 2]).max())
+            max_y_pt = float((all_placements_pt[:, 1] + all_placements_pt[:, 3]).max())
+        else:
+            max_x_pt, max_y_pt = 0, 0
+
+        sheet_width_pt = sheet_config['width'] * MM_TO_PT
+        sheet_height_pt = sheet_config['length'] * MM_TO_PT
         x_offset = (sheet_width_pt - max_x_pt) / 2 if max_x_pt < sheet_width_pt else 0
         y_offset = (sheet_height_pt - max_y_pt) / 2 if max_y_pt < sheet_height_pt else 0
 
         logging.info("--- CÁLCULO DE CENTRADO (en mm) ---")
-        logging.info(f"Max(X) Ocupado: {max_x_pt / (72 / 25.4):.2f}")
-        logging.info(f"Max(Y) Ocupado: {max_y_pt / (72 / 25.4):.2f}")
-        logging.info(f"Margen_x: {x_offset / (72 / 25.4):.2f}")
-        logging.info(f"Margen_y: {y_offset / (72 / 25.4):.2f}")
+        logging.info(f"Max(X) Ocupado: {max_x_pt / MM_TO_PT:.2f}")
+        logging.info(f"Max(Y) Ocupado: {max_y_pt / MM_TO_PT:.2f}")
+        logging.info(f"Margen_x: {x_offset / MM_TO_PT:.2f}")
+        logging.info(f"Margen_y: {y_offset / MM_TO_PT:.2f}")
         logging.info("-------------------------------------")
 
-        final_doc = fitz.open()
+        final_doc = out_doc if out_doc is not None else fitz.open()
         final_page = final_doc.new_page(width=sheet_width_pt, height=sheet_height_pt)
-        cut_coords_x, cut_coords_y = set(), set()
+        # Buffers de coordenadas de corte dimensionados de antemano: 2 por placement en cada eje
+        cut_coords_x = np.empty(2 * len(all_placements_pt), dtype=np.float32)
+        cut_coords_y = np.empty(2 * len(all_placements_pt), dtype=np.float32)
+        cut_index = 0
 
         # 3. ESTAMPADO Y RECOLECCIÓN DE COORDENADAS DE CORTE
-        for job in jobs:
+        # Los trabajos se estampan agrupados por PDF fuente (en orden de primera aparición, orden estable dentro
+        # de cada grupo): así cada documento se usa en un único tramo contiguo y se cierra al terminarlo
+        first_use = {}
+        for i, job in enumerate(jobs):
+            first_use.setdefault(job_hashes[job['job_name']], i)
+        stamp_order = sorted(range(len(jobs)), key=lambda i: first_use[job_hashes[jobs[i]['job_name']]])
+        # Índice del último trabajo que usa cada PDF, para cerrarlo apenas deja de necesitarse
+        last_use = {job_hashes[jobs[i]['job_name']]: i for i in stamp_order}
+        # El detalle por placement solo se formatea si el nivel DEBUG está activo
+        log_placements = logging.getLogger().isEnabledFor(logging.DEBUG)
+        for job_index in stamp_order:
+            job = jobs[job_index]
             job_name = job['job_name']
-            pdf_content = job_files[job_name]
-            placements = job['placements']
             user_bleed_mm = job['trim_box']['bleed']
-            user_bleed_pt = user_bleed_mm * (72 / 25.4)
-
-            with fitz.open(stream=pdf_content, filetype="pdf") as source_doc:
-                source_page = source_doc[0] 
-                trimbox = source_page.trimbox
-                is_source_landscape = trimbox.width > trimbox.height
-
-                source_page.set_cropbox(fitz.Rect(
-                    trimbox.x0 - user_bleed_pt,
-                    trimbox.y0 - user_bleed_pt,
-                    trimbox.x1 + user_bleed_pt,
-                    trimbox.y1 + user_bleed_pt
-                ))
-
-                for pos in placements:
-                    is_placement_landscape = pos['width'] > pos['length']
-                    rotation_angle = 90 if is_source_landscape!= is_placement_landscape else 0
-                    
-                    x_pt = (pos['x'] * (72 / 25.4)) + x_offset
-                    y_pt = (pos['y'] * (72 / 25.4)) + y_offset
-                    dest_width_pt = pos['width'] * (72 / 25.4)
-                    dest_height_pt = pos['length'] * (72 / 25.4)
-                    rect = fitz.Rect(x_pt, y_pt, x_pt + dest_width_pt, y_pt + dest_height_pt)
-                    
-                    logging.info(f"--- Colocando '{job_name}' en el pliego ---")
-                    logging.info(f"  Coordenadas del Rect (en mm):")
-                    logging.info(f"    - x0: {rect.x0 / (72 / 25.4):.2f}")
-                    logging.info(f"    - y0: {rect.y0 / (72 / 25.4):.2f}")
-                    logging.info(f"  Dimensiones del Rect (en mm):")
-                    logging.info(f"    - Ancho: {rect.width / (72 / 25.4):.2f}")
-                    logging.info(f"    - Alto: {rect.height / (72 / 25.4):.2f}")
-                    logging.info(f"  Rotación aplicada: {rotation_angle} grados")
-
-                    final_page.show_pdf_page(rect, source_doc, 0, rotate=rotation_angle)
-
-                    trim_w_pt, trim_h_pt = trimbox.width, trimbox.height
-                    if rotation_angle == 90:
-                        trim_w_pt, trim_h_pt = trim_h_pt, trim_w_pt
-                    
-                    center_x = rect.x0 + dest_width_pt / 2
-                    center_y = rect.y0 + dest_height_pt / 2
-                    
-                    tl_x = center_x - trim_w_pt / 2
-                    tl_y = center_y - trim_h_pt / 2
-                    br_x = center_x + trim_w_pt / 2
-                    br_y = center_y + trim_h_pt / 2
-
-                    cut_coords_x.add(tl_x); cut_coords_x.add(br_x)
-                    cut_coords_y.add(tl_y); cut_coords_y.add(br_y)
+            user_bleed_pt = user_bleed_mm * MM_TO_PT
+
+            pdf_hash = job_hashes[job_name]
+            source_doc = opened[pdf_hash]
+            # El TrimBox ya se leyó de MuPDF en la validación; se trabaja con locales
+            tb_x0, tb_y0, tb_x1, tb_y1 = trimboxes[pdf_hash]
+            # Dimensiones del TrimBox constantes para todos los placements de este trabajo
+            trim_w_pt, trim_h_pt = tb_x1 - tb_x0, tb_y1 - tb_y0
+            is_source_landscape = trim_w_pt > trim_h_pt
+
+            # Área a estampar: TrimBox + sangrado, limitada al MediaBox. Se fija una vez por trabajo antes de sus
+            # placements, así un PDF compartido por trabajos con distinto sangrado recibe el CropBox de cada uno
+            source_page = source_doc[0]
+            source_page.set_cropbox(fitz.Rect(
+                tb_x0 - user_bleed_pt,
+                tb_y0 - user_bleed_pt,
+                tb_x1 + user_bleed_pt,
+                tb_y1 + user_bleed_pt
+            ) & source_page.mediabox)
+
+            placements_pt = placements_pt_by_job[job_index]
+            rects = placements_to_rects(placements_pt, x_offset, y_offset)
+            widths, heights = placements_pt[:, 2], placements_pt[:, 3]
+            rotated = (widths > heights) != is_source_landscape
+            # Ángulos y rects pasados a listas de Python una sola vez, fuera del bucle de estampado
+            rotation_angles = np.where(rotated, 90, 0).tolist()
+
+            for placement_index, ((x0, y0, x1, y1), rotation_angle) in enumerate(zip(rects.tolist(), rotation_angles)):
+                if placement_index and placement_index % STORE_SHRINK_CHUNK == 0:
+                    fitz.TOOLS.store_shrink(100)
+
+                rect = fitz.Rect(x0, y0, x1, y1)
+                
+                if log_placements:
+                    logging.debug(f"--- Colocando '{job_name}' en el pliego ---")
+                    logging.debug(f"  Coordenadas del Rect (en mm):")
+                    logging.debug(f"    - x0: {rect.x0 / MM_TO_PT:.2f}")
+                    logging.debug(f"    - y0: {rect.y0 / MM_TO_PT:.2f}")
+                    logging.debug(f"  Dimensiones del Rect (en mm):")
+                    logging.debug(f"    - Ancho: {rect.width / MM_TO_PT:.2f}")
+                    logging.debug(f"    - Alto: {rect.height / MM_TO_PT:.2f}")
+                    logging.debug(f"  Rotación aplicada: {rotation_angle} grados")
+
+                final_page.show_pdf_page(rect, source_doc, 0, rotate=rotation_angle)
+
+            # Líneas de corte: el TrimBox (rotado si corresponde) centrado en cada placement
+            tw = np.where(rotated, trim_h_pt, trim_w_pt)
+            th = np.where(rotated, trim_w_pt, trim_h_pt)
+            center_x = rects[:, 0] + widths / 2
+            center_y = rects[:, 1] + heights / 2
+            n = len(rects)
+            cut_coords_x[cut_index:cut_index + n] = center_x - tw / 2
+            cut_coords_x[cut_index + n:cut_index + 2 * n] = center_x + tw / 2
+            cut_coords_y[cut_index:cut_index + n] = center_y - th / 2
+            cut_coords_y[cut_index + n:cut_index + 2 * n] = center_y + th / 2
+            cut_index += 2 * n
+
+            # Se libera el documento fuente y la caché de MuPDF antes de pasar al siguiente trabajo
+            if last_use[pdf_hash] == job_index:
+                opened.pop(pdf_hash).close()
+            fitz.TOOLS.store_shrink(100)
 
         # 4. DIBUJO DE MARCAS DE CORTE PROFESIONALES
         mark_len = 14
         mark_color = (0, 0, 0)
         mark_width = 0.3
 
-        for x in sorted(list(cut_coords_x)):
-            final_page.draw_line(fitz.Point(x, y_offset - mark_len), fitz.Point(x, y_offset), color=mark_color, width=mark_width)
-            final_page.draw_line(fitz.Point(x, max_y_pt + y_offset), fitz.Point(x, max_y_pt + y_offset + mark_len), color=mark_color, width=mark_width)
-        for y in sorted(list(cut_coords_y)):
-            final_page.draw_line(fitz.Point(x_offset - mark_len, y), fitz.Point(x_offset, y), color=mark_color, width=mark_width)
-            final_page.draw_line(fitz.Point(max_x_pt + x_offset, y), fitz.Point(max_x_pt + x_offset + mark_len, y), color=mark_color, width=mark_width)
+        cx = _merge_coords(cut_coords_x[:cut_index])
+        cy = _merge_coords(cut_coords_y[:cut_index])
+        # Solo los cortes al ras del borde del pliego coinciden con su refilado y no llevan marca; los bordes del
+        # área impuesta (centrada con márgenes) son cortes reales
+        cx = cx[(np.abs(cx) > EDGE_EPS_PT) & (np.abs(cx - sheet_width_pt) > EDGE_EPS_PT)]
+        cy = cy[(np.abs(cy) > EDGE_EPS_PT) & (np.abs(cy - sheet_height_pt) > EDGE_EPS_PT)]
+
+        # Todas las marcas se acumulan en un único Shape y se escriben en el pliego con un solo commit
+        # Bordes de las bandas de marcas (arriba/abajo para X, izquierda/derecha para Y), constantes para todo el pliego
+        top_start, top_end = y_offset - mark_len, y_offset
+        bottom_start, bottom_end = max_y_pt + y_offset, max_y_pt + y_offset + mark_len
+        left_start, left_end = x_offset - mark_len, x_offset
+        right_start, right_end = max_x_pt + x_offset, max_x_pt + x_offset + mark_len
+
+        if cx.size or cy.size:
+            shape = final_page.new_shape()
+            for x in cx:
+                shape.draw_line(fitz.Point(x, top_start), fitz.Point(x, top_end))
+                shape.draw_line(fitz.Point(x, bottom_start), fitz.Point(x, bottom_end))
+            for y in cy:
+                shape.draw_line(fitz.Point(left_start, y), fitz.Point(left_end, y))
+                shape.draw_line(fitz.Point(right_start, y), fitz.Point(right_end, y))
+            # closePath=False como en Page.draw_line: las marcas son segmentos abiertos
+            shape.finish(color=mark_color, width=mark_width, closePath=False)
+            shape.commit()
         
-        return final_doc.tobytes()
+        if out_doc is not None:
+            return None
+
+        # Se guarda directamente en un BytesIO: sin el bytes intermedio de tobytes() que luego habría que copiar.
+        # garbage/deflate/clean compactan el PDF de salida y reducen el tamaño de la respuesta
+        pdf_buffer = io.BytesIO()
+        final_doc.save(pdf_buffer, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True)
+        # Cerramos explícitamente (sin esperar al GC) y liberamos el store antes de devolver el PDF a Flask
+        final_doc.close()
+        fitz.TOOLS.store_shrink(100)
+        pdf_buffer.seek(0)
+        return pdf_buffer
     except Exception as e:
         tb_str = traceback.format_exc()
         logging.error(f"--- ERROR INESPERADO EN validate_and_create_imposition ---\n{tb_str}\n--------------------")
         # Re-lanzamos la excepción para que Flask la maneje como un 500
-        raise e
\ No newline at end of file
+        raise e
+    finally:
+        for doc in opened.values():
+            doc.close()
\ No newline at end of file
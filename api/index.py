@@ -1,17 +1,28 @@
 from flask import Flask, request, jsonify, send_file
+from flask_compress import Compress
 import json
-import io
-from .optimizer import main as run_optimizer #otro comentario nuevo
+import os
+import shutil
+import tempfile
+from .optimizer import optimize as run_optimizer
 from . import imposition_service 
 
 app = Flask(__name__)
 
+# Las respuestas JSON (plan de armado, previsualizaciones) se comprimen según el Accept-Encoding del cliente.
+# El PDF ya sale comprimido por PyMuPDF (deflate), así que no se vuelve a comprimir.
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_LEVEL'] = 6
+Compress(app)
 
-@app.route('/api/validate-and-preview-pdf', methods=['POST', 'OPTIONS'])
+# Tamaño de bloque para copiar los PDFs subidos a disco
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+# Sin 'OPTIONS' en methods: Flask responde los preflight automáticamente sin entrar al handler
+# (las cabeceras CORS las agrega vercel.json)
+@app.route('/api/validate-and-preview-pdf', methods=['POST'])
 def validate_and_preview_endpoint():
-    if request.method == 'OPTIONS':
-        return '', 204
-        
     if 'file' not in request.files:
         return jsonify({"error": "No se recibió ningún archivo."}), 400
     if 'expected_width' not in request.form or 'expected_height' not in request.form or 'bleed' not in request.form:
@@ -26,13 +37,20 @@ def validate_and_preview_endpoint():
         bleed_mm = float(request.form['bleed'])
     except ValueError:
         return jsonify({"error": "Las dimensiones o el sangrado deben ser números."}), 400
+
+    # Opcional: render_preview=false valida sin generar la imagen (el front pide la previsualización aparte)
+    render_preview = request.form.get('render_preview', 'true').lower() not in ('false', '0')
+    # Opcional: grayscale=true genera la previsualización en escala de grises (payload más liviano)
+    grayscale = request.form.get('grayscale', 'false').lower() in ('true', '1')
     
     # Llamamos al servicio con todos los parámetros
     result = imposition_service.validate_and_preview_pdf(
         pdf_content=pdf_content,
         expected_width=expected_width,
         expected_height=expected_height,
-        bleed_mm=bleed_mm
+        bleed_mm=bleed_mm,
+        render_preview=render_preview,
+        grayscale=grayscale
     ) # <--- Este es el paréntesis de cierre que probablemente faltaba.
     
     if not result.get('isValid'):
@@ -51,31 +69,21 @@ def optimize_endpoint():
         if not input_data:
             return jsonify({"error": "No se recibió un input JSON válido."}), 400
 
-        # 2. Guardar temporalmente el input para que el script lo lea
-        temp_input_filename = "/tmp/input.json"
-        with open(temp_input_filename, 'w', encoding='utf-8') as f:
-            json.dump(input_data, f, ensure_ascii=False, indent=2)
-
-        # 3. Ejecutar tu script de optimización
-        run_optimizer(temp_input_filename)
-
-        # 4. Leer el output.json generado por el script
-        temp_output_filename = "/tmp/output.json" # Asegúrate que tu script escriba aquí
-        with open(temp_output_filename, 'r', encoding='utf-8') as f:
-            output_data = json.load(f)
+        # 2. Ejecutar el optimizador en memoria (sin pasar por archivos en /tmp,
+        #    que además se pisaban entre peticiones concurrentes)
+        output_data = run_optimizer(input_data)
         
-        # 5. Devolver el resultado
+        # 3. Devolver el resultado
         return jsonify(output_data), 200
 
     except Exception as e:
         # Manejo de errores
         return jsonify({"error": "Ocurrió un error en el servidor.", "details": str(e)}), 500
 
-# Es importante modificar tu optimizer.py para que escriba en /tmp/output.json
-# y no en el directorio local, ya que Vercel solo permite escribir en /tmp.
-
 @app.route('/api/generate-imposition', methods=['POST'])
 def generate_imposition_endpoint():
+    job_files = {}
+    tmp_paths = []
     try:
         # 1. Recibir los datos del formulario (multipart/form-data)
         # El JSON con el plan de armado viene como un string en un campo de texto
@@ -90,11 +98,16 @@ def generate_imposition_endpoint():
         if not files:
             return jsonify({"error": "No se recibieron archivos PDF."}), 400
 
-        # Mapeamos los archivos por su nombre para un acceso fácil
-        job_files = {file.filename: file.read() for file in files}
+        # Mapeamos los archivos por su nombre para un acceso fácil. Cada PDF se copia en bloques
+        # de 64 KB a un archivo temporal y se pasa su ruta, así nunca se cargan todos completos en memoria
+        for file in files:
+            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+                tmp_paths.append(tmp.name)
+                shutil.copyfileobj(file.stream, tmp, UPLOAD_CHUNK_SIZE)
+            job_files[file.filename] = tmp.name
 
         # 2. Llamar a nuestro servicio de imposición
-        pdf_bytes = imposition_service.validate_and_create_imposition(
+        pdf_buffer = imposition_service.validate_and_create_imposition(
             sheet_config=layout['sheet_config'],
             jobs=layout['jobs'],
             job_files=job_files
@@ -102,7 +115,7 @@ def generate_imposition_endpoint():
 
         # 3. Devolver el PDF generado
         return send_file(
-            io.BytesIO(pdf_bytes),
+            pdf_buffer,
             mimetype='application/pdf',
             as_attachment=True,
             download_name='pliego_impuesto.pdf'
@@ -112,3 +125,6 @@ def generate_imposition_endpoint():
         return jsonify({"error": "Error de validación.", "details": str(e)}), 400
     except Exception as e: # Errores inesperados
         return jsonify({"error": "Ocurrió un error en el servidor.", "details": str(e)}), 500
+    finally:
+        for path in tmp_paths:
+            os.remove(path)
@@ -1,28 +1,44 @@
+import dataclasses
+import functools
 import json
+import os
 import sys
 import math
 import time
-from datetime import datetime
 from ortools.sat.python import cp_model
+try:
+    import orjson
+except ImportError:  # Si orjson no está instalado se usa el módulo json estándar
+    orjson = None
 import rectpack
-from itertools import chain, combinations, product
+import numpy as np
+from collections import defaultdict
+from itertools import chain, combinations, repeat
 from dataclasses import dataclass, field
 from typing import List, Dict, Any
 import rectpack.guillotine as guillotine
 
+# Configuración del dibujante (rectpack) para los layouts de ganging, definida una sola vez
+PACKER_ALGO = guillotine.GuillotineBssfMaxas
+PACKER_ROTATION = True
+
+# Detalle por pliego de la fase 2 (análisis, recetas probadas, éxitos); apagado por defecto porque se
+# imprime miles de veces por corrida. OPTIMIZER_VERBOSE=1 lo activa
+VERBOSE = os.environ.get('OPTIMIZER_VERBOSE', '') == '1'
+
 # region ESTRUCTURAS DE DATOS (Actualizadas para el nuevo Input)
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Size:
     width: int
     length: int
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class FactorySize:
     width: int
     length: int
     usdPerTon: float
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Material:
     id: str # Cambiado a String para aceptar "Obra"
     name: str
@@ -30,7 +46,7 @@ class Material:
     isSpecialMaterial: bool
     factorySizes: List[FactorySize]
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Job:
     id: str
     width: int
@@ -43,20 +59,25 @@ class Job:
     backInks: int
     isDuplex: bool
     samePlatesForBack: bool
+    # Área del trabajo sin sangrado, calculada una vez (se usa en todo el enumerado de la fase 2)
+    job_area: int = field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'job_area', self.width * self.length)
     
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Overage:
     amount: int
     perInk: bool
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class CostInfo:
     price: float = 0.0 # Valor por defecto
     perInk: bool = False
     perInkPass: bool = False
     pricePerThousand: float = 0.0 # Añadido para compatibilidad
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Machine:
     id: str
     name: str
@@ -75,24 +96,24 @@ class Machine:
     price_brackets: List[Dict[str, Any]]
     created_at: str
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Penalties:
     differentMachinePenalty: int
     differentPressSheetPenalty: int
     differentFactorySheetPenalty: int
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Options:
     timeoutSeconds: int
     numberOfSolutions: int
     penalties: Penalties
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class AvailableCutMap:
     forPaperSize: Size
     sheetSizes: List[Size]
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class InputData:
     options: Options
     commonDetails: Dict[str, float]
@@ -100,14 +121,16 @@ class InputData:
     machines: List[Machine]
     availableCuts: List[AvailableCutMap]
     dollarRate: float
+    # (machine.id, ancho, largo) -> si el pliego entra en la máquina; se calcula una vez en parse_input_data
+    sheetCompatibility: Dict[tuple, bool] = field(default_factory=dict)
 # endregion
 
 # region CALLBACK PARA MÚLTIPLES SOLUCIONES
 class SolutionCallback(cp_model.CpSolverSolutionCallback):
-    def __init__(self, use_layout_vars, all_viable_layouts, total_cost_var, limit):
+    def __init__(self, use_layout_vars, layouts_by_id, total_cost_var, limit):
         super().__init__()
         self.use_layout_vars = use_layout_vars
-        self.all_viable_layouts = all_viable_layouts
+        self.layouts_by_id = layouts_by_id
         self.total_cost_var = total_cost_var
         self.limit = limit
         self.solutions = []
@@ -119,7 +142,7 @@ class SolutionCallback(cp_model.CpSolverSolutionCallback):
         plan = []
         for l_id, v in self.use_layout_vars.items():
             if self.Value(v) == 1:
-                layout_obj = next((l for l in self.all_viable_layouts if l['layout_id'] == l_id), None)
+                layout_obj = self.layouts_by_id.get(l_id)
                 if layout_obj:
                     plan.append({
                         'id': l_id,
@@ -127,7 +150,7 @@ class SolutionCallback(cp_model.CpSolverSolutionCallback):
                         'costForThisPlanItem': round(layout_obj['total_cost'], 2)
                     })
         
-        layouts_in_plan = {l['layout_id']: l for l in self.all_viable_layouts if l['layout_id'] in [p['id'] for p in plan]}
+        layouts_in_plan = {p['id']: self.layouts_by_id[p['id']] for p in plan}
         
         self.solutions.append({
             'summary': {'gangedTotalCost': cost},
@@ -145,29 +168,123 @@ def packer_grid_layout(sheet_w, sheet_h, cut_w, cut_h):
     """Calcula un grid simple y devuelve el desglose, incluyendo posiciones."""
     if cut_w <= 0 or cut_h <= 0: return {'cutsPerSheet': 0, 'positions': []}
     
-    positions1, positions2 = [], []
+    # Primero solo se cuentan los cortes de cada orientación; las posiciones se arman únicamente para la elegida
     count1, count2 = 0, 0
 
     # Opción 1: Sin rotar
     if sheet_w >= cut_w and sheet_h >= cut_h:
-        cols, rows = math.floor(sheet_w / cut_w), math.floor(sheet_h / cut_h)
-        count1 = cols * rows
-        for r in range(rows):
-            for c in range(cols):
-                positions1.append({'x': c * cut_w, 'y': r * cut_h, 'width': cut_w, 'length': cut_h})
+        count1 = math.floor(sheet_w / cut_w) * math.floor(sheet_h / cut_h)
 
     # Opción 2: Rotado
     if sheet_w >= cut_h and sheet_h >= cut_w:
-        cols, rows = math.floor(sheet_w / cut_h), math.floor(sheet_h / cut_w)
-        count2 = cols * rows
-        for r in range(rows):
-            for c in range(cols):
-                positions2.append({'x': c * cut_h, 'y': r * cut_w, 'width': cut_h, 'length': cut_w})
+        count2 = math.floor(sheet_w / cut_h) * math.floor(sheet_h / cut_w)
 
     if count1 >= count2:
-        return {'cutsPerSheet': count1, 'positions': positions1}
+        if count1 == 0: return {'cutsPerSheet': 0, 'positions': []}
+        piece_w, piece_h = cut_w, cut_h
     else:
-        return {'cutsPerSheet': count2, 'positions': positions2}
+        piece_w, piece_h = cut_h, cut_w
+    cols, rows = math.floor(sheet_w / piece_w), math.floor(sheet_h / piece_h)
+    positions = [{'x': c * piece_w, 'y': r * piece_h, 'width': piece_w, 'length': piece_h} for r in range(rows) for c in range(cols)]
+    return {'cutsPerSheet': cols * rows, 'positions': positions}
+
+def packer_grid_layout_batch(sheet_w, sheet_h, cut_w, cut_h):
+    """
+    Versión vectorizada de packer_grid_layout para muchos pliegos a la vez (sheet_w/sheet_h son arrays).
+    Devuelve solo la cantidad de cortes por pliego y si conviene la orientación rotada; las posiciones
+    se generan después con packer_grid_layout únicamente para la opción elegida.
+    """
+    sheet_w, sheet_h = np.asarray(sheet_w), np.asarray(sheet_h)
+    if cut_w <= 0 or cut_h <= 0:
+        zeros = np.zeros(sheet_w.shape, dtype=np.int64)
+        return zeros, zeros.astype(bool)
+    count1 = np.where((sheet_w >= cut_w) & (sheet_h >= cut_h), (sheet_w // cut_w) * (sheet_h // cut_h), 0).astype(np.int64)
+    count2 = np.where((sheet_w >= cut_h) & (sheet_h >= cut_w), (sheet_w // cut_h) * (sheet_h // cut_w), 0).astype(np.int64)
+    return np.maximum(count1, count2), count2 > count1
+
+def _join_free_section(section, other):
+    """Réplica de rectpack Rectangle.join sobre listas [x, y, ancho, alto]: absorbe 'other' en 'section' si la unión es un rectángulo."""
+    sx, sy, sw, sh = section
+    ox, oy, ow, oh = other
+    if oy >= sy and ox >= sx and oy + oh <= sy + sh and ox + ow <= sx + sw:
+        return True
+    if sy >= oy and sx >= ox and sy + sh <= oy + oh and sx + sw <= ox + ow:
+        section[:] = other
+        return True
+    if sy > oy + oh or sy + sh < oy or sx > ox + ow or sx + sw < ox:
+        return False
+    if sx == ox and sw == ow:
+        y_min = min(sy, oy)
+        section[1], section[3] = y_min, max(sy + sh, oy + oh) - y_min
+        return True
+    if sy == oy and sh == oh:
+        x_min = min(sx, ox)
+        section[0], section[2] = x_min, max(sx + sw, ox + ow) - x_min
+        return True
+    return False
+
+def _add_free_section(sections, section):
+    """Réplica de rectpack Guillotine._add_section: une la sección nueva con las existentes hasta que no cambie nada."""
+    plen = 0
+    while sections and plen != len(sections):
+        plen = len(sections)
+        sections = [s for s in sections if not _join_free_section(section, s)]
+    sections.append(section)
+    return sections
+
+def _pack_guillotine_bssf_maxas(sheet_w, sheet_h, rect_groups, rotation):
+    """
+    Equivalente a rectpack.newPacker(pack_algo=GuillotineBssfMaxas) con un solo pliego (modo offline, orden por
+    área): mismas secciones libres, mismos criterios y desempates, pero sobre listas en vez de objetos Rectangle.
+    Devuelve [(rid, x, y, ancho, largo)] en orden de colocación, o None apenas una pieza no entra.
+    """
+    sections = [[0, 0, sheet_w, sheet_h]]
+    placed = []
+    # Ordenar los grupos (estable, por área) y después repetir cada uno da la misma secuencia que ordenar
+    # la lista pieza por pieza, sin armarla
+    ordered_groups = sorted(rect_groups, reverse=True, key=lambda g: g[0] * g[1])
+    for w, h, rid in chain.from_iterable(repeat((w, h, rid), count) for w, h, rid, count in ordered_groups):
+        # BSSF: menor sobrante del lado corto; primero todas las secciones sin rotar, después rotado
+        best_i, best_fit, rotated = None, None, False
+        for i, (_, _, s_w, s_h) in enumerate(sections):
+            if w <= s_w and h <= s_h:
+                fit = min(s_w - w, s_h - h)
+                if best_fit is None or fit < best_fit: best_i, best_fit = i, fit
+        if rotation:
+            for i, (_, _, s_w, s_h) in enumerate(sections):
+                if h <= s_w and w <= s_h:
+                    fit = min(s_w - h, s_h - w)
+                    if best_fit is None or fit < best_fit: best_i, best_fit, rotated = i, fit, True
+        if best_i is None: return None
+        if rotated: w, h = h, w
+
+        s_x, s_y, s_w, s_h = sections.pop(best_i)
+        # MAXAS: el corte que deja la sección sobrante más grande
+        if w * (s_h - h) <= h * (s_w - w):
+            if h < s_h: sections = _add_free_section(sections, [s_x, s_y + h, s_w, s_h - h])
+            if w < s_w: sections = _add_free_section(sections, [s_x + w, s_y, s_w - w, h])
+        else:
+            if h < s_h: sections = _add_free_section(sections, [s_x, s_y + h, w, s_h - h])
+            if w < s_w: sections = _add_free_section(sections, [s_x + w, s_y, s_w - w, s_h])
+        placed.append((rid, s_x, s_y, w, h))
+    return placed
+
+def pack_on_sheet(sheet_w, sheet_h, rect_groups):
+    """
+    Empaqueta grupos de piezas iguales [(ancho, largo, rid, cantidad)] en un pliego con la configuración
+    PACKER_ALGO / PACKER_ROTATION. Devuelve [(rid, x, y, ancho, largo)] si entraron todas las piezas, o None.
+    """
+    if PACKER_ALGO is guillotine.GuillotineBssfMaxas:
+        return _pack_guillotine_bssf_maxas(sheet_w, sheet_h, rect_groups, PACKER_ROTATION)
+    # Cualquier otro algoritmo se resuelve con rectpack
+    packer = rectpack.newPacker(pack_algo=PACKER_ALGO, rotation=PACKER_ROTATION)
+    for w, h, rid, count in rect_groups:
+        for _ in range(count): packer.add_rect(w, h, rid=rid)
+    packer.add_bin(sheet_w, sheet_h)
+    packer.pack()
+    # El dibujante falló si el packer quedó vacío o no ubicó todas las piezas
+    if not packer or len(packer[0]) != sum(count for *_, count in rect_groups): return None
+    return [(p.rid, p.x, p.y, p.width, p.height) for p in packer[0]]
 
 def get_printing_needs(job_details, machine):
     front_inks, back_inks = job_details.get('frontInks', 0), job_details.get('backInks', 0)
@@ -186,10 +303,10 @@ def get_printing_needs(job_details, machine):
 
     if technique == 'SIMPLEX':
         total_plates = front_inks
-        passes = math.ceil(front_inks / printing_bodies) if printing_bodies > 0 else float('inf')
+        passes = -(-front_inks // printing_bodies) if printing_bodies > 0 else float('inf')
     else: # DUPLEX
         total_plates = front_inks + back_inks
-        passes = math.ceil(front_inks / printing_bodies) + math.ceil(back_inks / printing_bodies) if printing_bodies > 0 else float('inf')
+        passes = -(-front_inks // printing_bodies) - (-back_inks // printing_bodies) if printing_bodies > 0 else float('inf')
     # --- FIN DE LA MODIFICACIÓN ---
     
     return {'technique': technique, 'totalPlates': total_plates, 'passes': passes}
@@ -220,16 +337,45 @@ def calculate_printing_cost(machine, print_needs, net_sheets):
         'totalPrintingCost': setup_cost + wash_cost + impression_cost
     }
 
+@functools.lru_cache(maxsize=1024)
+def _factory_cut_counts(factory_dims, ps_w, ps_l):
+    """Cortes por pliego de fábrica para todos los tamaños a la vez; solo depende de la geometría, no del tiraje."""
+    counts, _ = packer_grid_layout_batch([w for w, _ in factory_dims], [l for _, l in factory_dims], ps_w, ps_l)
+    return tuple(counts.tolist())
+
+@functools.lru_cache(maxsize=1024)
+def _factory_cutting_plan(fs_w, fs_l, ps_w, ps_l):
+    """Plan de corte (con posiciones) de un pliego de fábrica; se comparte entre llamadas y no debe modificarse."""
+    return packer_grid_layout(fs_w, fs_l, ps_w, ps_l)
+
+@functools.lru_cache(maxsize=4096)
+def _best_factory_cut(factory_dims, ps_w, ps_l, total_printing_sheets):
+    """
+    Núcleo puro de calculate_material_needs, memoizado por valores (no depende de la máquina):
+    devuelve (índice del tamaño de fábrica elegido, pliegos de fábrica a cortar, plan de corte) o None.
+    La geometría (cortes por pliego y plan de corte) se memoiza aparte, sin el tiraje en la clave.
+    """
+    if not factory_dims: return None
+    counts = _factory_cut_counts(factory_dims, ps_w, ps_l)
+    if not any(counts): return None
+    sheets_needed = [-(-total_printing_sheets // c) if c > 0 else math.inf for c in counts]
+    best_index = min(range(len(sheets_needed)), key=sheets_needed.__getitem__)
+    best_w, best_l = factory_dims[best_index]
+    return best_index, sheets_needed[best_index], _factory_cutting_plan(best_w, best_l, ps_w, ps_l)
+
 def calculate_material_needs(material, printing_sheet, total_printing_sheets, dollar_rate):
-    best_factory_option = {'sheets_to_cut': float('inf')}
-    for factory_size in material.factorySizes:
-        plan = packer_grid_layout(factory_size.width, factory_size.length, printing_sheet.width, printing_sheet.length)
-        if plan['cutsPerSheet'] > 0:
-            factory_sheets_needed = math.ceil(total_printing_sheets / plan['cutsPerSheet'])
-            if factory_sheets_needed < best_factory_option['sheets_to_cut']:
-                best_factory_option = {'factory_size': factory_size, 'sheets_to_cut': factory_sheets_needed, 'cuttingPlan': plan}
-    
-    if 'factory_size' not in best_factory_option: return None
+    best_cut = _best_factory_cut(
+        tuple((fs.width, fs.length) for fs in material.factorySizes),
+        printing_sheet.width, printing_sheet.length, total_printing_sheets
+    )
+    if best_cut is None: return None
+
+    best_index, sheets_to_cut, cutting_plan = best_cut
+    best_factory_option = {
+        'factory_size': material.factorySizes[best_index],
+        'sheets_to_cut': sheets_to_cut,
+        'cuttingPlan': cutting_plan
+    }
 
     fs = best_factory_option['factory_size']
     cost_per_sheet = (((fs.width / 1000 * fs.length / 1000) * material.grammage) / 1000 / 1000) * fs.usdPerTon
@@ -246,7 +392,7 @@ def calculate_material_needs(material, printing_sheet, total_printing_sheets, do
 
 def calculate_total_layout_cost(layout, all_jobs, machine, dollar_rate):
     if not layout['jobs']: return None
-    net_sheets = max(math.ceil(all_jobs[job_id].quantity / qty) for job_id, qty in layout['jobs'].items() if qty > 0)
+    net_sheets = max(-(-all_jobs[job_id].quantity // qty) for job_id, qty in layout['jobs'].items() if qty > 0)
     if net_sheets == 0: return None
 
     details = {'frontInks': 0, 'backInks': 0, 'isDuplex': False, 'material': None}
@@ -297,22 +443,28 @@ def calculate_base_solution(data, all_jobs):
     total_base_cost = 0
     for job in data.jobs:
         best_option = {'total_cost': float('inf')}
+        imposition_width = job.width + (2 * job.bleed)
+        imposition_length = job.length + (2 * job.bleed)
+        # Cortes del material del trabajo y cuántas piezas entran en cada uno, calculados una sola vez
+        # (no dependen de la máquina) en una única operación vectorizada
+        job_cuts = [cut for factory_size in job.material.factorySizes for cut in get_cuts_for_factory_size(factory_size, data.availableCuts)]
+        cuts_per_sheet, _ = packer_grid_layout_batch(
+            [cut.width for cut in job_cuts], [cut.length for cut in job_cuts], imposition_width, imposition_length
+        )
+        best_cut = None
         for machine in data.machines:
-            for factory_size in job.material.factorySizes:
-                for cut in get_cuts_for_factory_size(factory_size, data.availableCuts):
-                    if not (max(cut.width, cut.length) <= max(machine.maxSheetSize.width, machine.maxSheetSize.length) and \
-                            min(cut.width, cut.length) <= min(machine.maxSheetSize.width, machine.maxSheetSize.length)):
-                        continue
-                    imposition_width = job.width + (2 * job.bleed)
-                    imposition_length = job.length + (2 * job.bleed)
-                    plan = packer_grid_layout(cut.width, cut.length, imposition_width, imposition_length)
-                    if plan['cutsPerSheet'] == 0: continue
-                    cost_info = calculate_total_layout_cost({'jobs': {job.id: plan['cutsPerSheet']}, 'printing_sheet': cut}, all_jobs, machine, data.dollarRate)
-                    if cost_info and cost_info['total_cost'] < best_option['total_cost']:
-                        best_option = cost_info
-                        best_option['jobs_in_layout'] = {job.id: plan['cutsPerSheet']}
-                        best_option['placements'] = plan['positions'] # Guardar placements para el output
+            for cut, cut_count in zip(job_cuts, cuts_per_sheet.tolist()):
+                if not data.sheetCompatibility[(machine.id, cut.width, cut.length)]:
+                    continue
+                if cut_count == 0: continue
+                cost_info = calculate_total_layout_cost({'jobs': {job.id: cut_count}, 'printing_sheet': cut}, all_jobs, machine, data.dollarRate)
+                if cost_info and cost_info['total_cost'] < best_option['total_cost']:
+                    best_option = cost_info
+                    best_option['jobs_in_layout'] = {job.id: cut_count}
+                    best_cut = cut
         if best_option['total_cost'] != float('inf'):
+            # Las posiciones solo se generan para el corte ganador
+            best_option['placements'] = packer_grid_layout(best_cut.width, best_cut.length, imposition_width, imposition_length)['positions'] # Guardar placements para el output
             log(f"  > Mejor opción para '{job.id}': {best_option['net_sheets']} pliegos. Costo: {best_option['total_cost']:.2f}")
             best_option['layout_id'] = f"base_{job.id}"
             base_layouts.append(best_option)
@@ -320,78 +472,126 @@ def calculate_base_solution(data, all_jobs):
     log(f"  > Costo Base Total (individual): {total_base_cost:.2f}")
     return base_layouts, total_base_cost
 
+def _enumerate_area_feasible(job_areas, job_demands, max_qtys, cut_area):
+    """
+    Enumera las recetas (cantidad por trabajo, de 1 a max_qty) cuya área total entra en el pliego.
+    Se arman trabajo por trabajo con operaciones NumPy sobre todos los estados a la vez: una receta
+    parcial que ya no entra (contando al menos 1 unidad de cada trabajo restante) se descarta sin
+    expandirla. Las recetas salen en el mismo orden que en el producto completo de rangos.
+    Devuelve (recetas (S, k), tirajes (S,)).
+    """
+    # Área mínima que todavía ocupan los trabajos posteriores a cada posición (1 unidad de cada uno)
+    min_remaining_area = [sum(job_areas[k + 1:]) for k in range(len(job_areas))]
+
+    recipes = np.zeros((1, 0), dtype=np.int64)
+    used_area = np.zeros(1)
+    tirajes = np.zeros(1, dtype=np.int64)
+    for area, demand, max_qty, remaining in zip(job_areas, job_demands, max_qtys, min_remaining_area):
+        qty = np.arange(1, max_qty + 1)
+        new_area = used_area[:, None] + qty[None, :] * area
+        fits = (new_area + remaining <= cut_area).ravel()
+        n_states = len(recipes)
+        recipes = np.column_stack((np.repeat(recipes, max_qty, axis=0), np.tile(qty, n_states)))[fits]
+        used_area = new_area.ravel()[fits]
+        tirajes = np.maximum(tirajes[:, None], (-(-demand // qty))[None, :]).ravel()[fits]
+    return recipes, tirajes
+
 def generate_candidate_layouts(data: InputData, all_jobs: Dict[str, Job]):
     log("--- FASE 2: Generando layouts de ganging candidatos ---")
     start_time, champion_layouts = time.time(), []
 
-    for i in range(2, len(data.jobs) + 1):
-        for job_subset in combinations(data.jobs, i):
-            material_for_gang = job_subset[0].material
-            log(f"  > Probando combinación de {i} trabajos: {[j.id for j in job_subset]} en material '{material_for_gang.name}'")
-
-            all_possible_cuts = {f"{c.width}x{c.length}": c for fs in material_for_gang.factorySizes for c in get_cuts_for_factory_size(fs, data.availableCuts)}
-
-            for cut_key, cut in all_possible_cuts.items():
-                if time.time() - start_time > data.options.timeoutSeconds:
-                    log("  > Timeout alcanzado."); return champion_layouts
-                log(f"    > Analizando Pliego: {cut.width}x{cut.length}...")
-                
-                candidates = []
-                quantity_ranges_to_test = []
+    # Solo se combinan trabajos del mismo material (se imprimen en el mismo pliego)
+    jobs_by_material = defaultdict(list)
+    for job in data.jobs:
+        jobs_by_material[job.material.id].append(job)
+    # Campeón por (pliego, forma de los trabajos): subconjuntos con las mismas medidas, sangrado y cantidades
+    # (aunque sean otros trabajos u otro material) dan el mismo resultado del dibujante, solo cambian los ids
+    champion_cache = {}
+    # Resultado del dibujante por (pliego, secuencia de (medida con sangrado, cantidad)): el packer solo depende
+    # de los rectángulos y de su orden de carga, no de qué trabajos son. Guarda las posiciones (índice del
+    # trabajo en el subconjunto, x, y, ancho, largo) o None si no entraron
+    pack_cache = {}
+
+    for material_jobs in jobs_by_material.values():
+        material_for_gang = material_jobs[0].material
+        all_possible_cuts = {f"{c.width}x{c.length}": c for fs in material_for_gang.factorySizes for c in get_cuts_for_factory_size(fs, data.availableCuts)}
+        max_cut_area = max((c.width * c.length for c in all_possible_cuts.values()), default=0)
+        # Un trabajo que (con sangrado) no entra en ningún pliego del material no puede formar parte de ninguna
+        # combinación: se descarta antes de enumerar subconjuntos en lugar de probarlo corte por corte
+        gangable_jobs = [
+            j for j in material_jobs
+            if any((w <= c.width and l <= c.length) or (l <= c.width and w <= c.length)
+                   for w, l in [(j.width + 2 * j.bleed, j.length + 2 * j.bleed)] for c in all_possible_cuts.values())
+        ]
+
+        for i in range(2, len(gangable_jobs) + 1):
+            for job_subset in combinations(gangable_jobs, i):
+                if any(j.job_area == 0 for j in job_subset): continue
+                # Datos del subconjunto que no dependen del pliego: se arman una vez y no por cada corte
+                # (tamaños y áreas con sangrado, que son los que se empaquetan)
+                imposition_sizes = [(j.width + 2 * j.bleed, j.length + 2 * j.bleed) for j in job_subset]
+                imposition_areas = [w * l for w, l in imposition_sizes]
+                # Si ni siquiera 1 unidad de cada trabajo entra en el pliego más grande, no hay receta posible
+                if sum(imposition_areas) > max_cut_area: continue
                 job_ids_in_subset = [j.id for j in job_subset]
+                job_demands = [j.quantity for j in job_subset]
+                job_shapes = tuple((j.width, j.length, j.bleed, j.quantity) for j in job_subset)
+                log(f"  > Probando combinación de {i} trabajos: {job_ids_in_subset} en material '{material_for_gang.name}'")
+
+                for cut_key, cut in all_possible_cuts.items():
+                    if time.time() - start_time > data.options.timeoutSeconds:
+                        log("  > Timeout alcanzado."); return champion_layouts
+                    if VERBOSE: log(f"    > Analizando Pliego: {cut.width}x{cut.length}...")
                 
-                for job in job_subset:
-                    job_area = job.width * job.length
-                    if job_area == 0:
-                        quantity_ranges_to_test = []
-                        break
-                    max_qty = min(30, math.floor((cut.width * cut.length) / job_area))
-                    if max_qty == 0:
-                        quantity_ranges_to_test = []
-                        break
-                    quantity_ranges_to_test.append(range(1, max_qty + 1))
-                
-                if not quantity_ranges_to_test: continue
-
-                for quantities_tuple in product(*quantity_ranges_to_test):
-                    recipe = dict(zip(job_ids_in_subset, quantities_tuple))
-                    
-                    total_area = sum(all_jobs[jid].width * all_jobs[jid].length * qty for jid, qty in recipe.items())
-                    if total_area <= (cut.width * cut.length):
-                        tiraje = max(math.ceil(all_jobs[jid].quantity / qty) for jid, qty in recipe.items())
-                        candidates.append({'recipe': recipe, 'tiraje': tiraje})
-
-                if not candidates: continue
-
-                candidates.sort(key=lambda x: x['tiraje'])
+                    shape_key = (cut.width, cut.length, job_shapes)
+                    if shape_key in champion_cache:
+                        cached = champion_cache[shape_key]
+                        if cached:
+                            source_ids, tiraje, champion = cached
+                            id_map = dict(zip(source_ids, job_ids_in_subset))
+                            recipe = {id_map[jid]: qty for jid, qty in champion['layout_details']['jobs'].items()}
+                            if VERBOSE: log(f"      > ÉXITO con tiraje {tiraje} (reutilizado): {recipe}")
+                            champion_layouts.append({
+                                'layout_details': {'jobs': recipe, 'printing_sheet': cut},
+                                'placements': [dict(p, id=id_map[p['id']]) for p in champion['placements']]
+                            })
+                        continue
+                    champion_cache[shape_key] = None
+                    # Una receta con una pieza que no entra en el pliego en ninguna orientación nunca se puede empaquetar
+                    if any(not ((w <= cut.width and l <= cut.length) or (l <= cut.width and w <= cut.length)) for w, l in imposition_sizes):
+                        continue
+                    # La poda por área se hace con el sangrado incluido: las ramas que no entran en el pliego
+                    # se cortan durante la enumeración en lugar de filtrarse después
+                    cut_area = cut.width * cut.length
+                    max_qtys = [min(30, cut_area // a) for a in imposition_areas]
+
+                    recipes, tirajes = _enumerate_area_feasible(imposition_areas, job_demands, max_qtys, cut_area)
+                    if not len(recipes): continue
+
+                    # Orden estable por tiraje (igual que el sort de Python); los dicts de receta solo se arman
+                    # para los candidatos que efectivamente se prueban con el dibujante
+                    order = np.argsort(tirajes, kind='stable')
+                    candidates = ({'recipe': dict(zip(job_ids_in_subset, recipes[idx].tolist())), 'tiraje': int(tirajes[idx])} for idx in order)
                 
-                log(f"      > {len(candidates)} combinaciones de área válidas encontradas. Probando con el dibujante...")
-
-                for cand in candidates:
-                    # Le indicamos al packer que use un algoritmo de guillotina
-                    packer = rectpack.newPacker( 
-                        pack_algo=guillotine.GuillotineBssfMaxas) 
-                    for job_id, qty in cand['recipe'].items():
-                        job = all_jobs[job_id]
-                        # Calculamos el tamaño final para el empaquetado
-                        imposition_width = job.width + (2 * job.bleed)
-                        imposition_length = job.length + (2 * job.bleed)
-                        for _ in range(qty): packer.add_rect(imposition_width, imposition_length, rid=job_id)
-                    packer.add_bin(cut.width, cut.length)
-                    packer.pack()
-                    
-                    # 1. Primero, verificamos que el packer NO esté vacío.
-                    #    Si lo está, significa que el dibujante falló.
-                    if packer:
-                        # 2. Ahora que sabemos que no está vacío, es seguro acceder a packer[0].
-                        #    Tu lógica original se mueve un nivel adentro.
-                        if len(packer[0]) == sum(cand['recipe'].values()):
-                            log(f"      > ÉXITO con tiraje {cand['tiraje']}: {cand['recipe']}")
-                            placements = [{'id': p.rid, 'x': p.x, 'y': p.y, 'width': p.width, 'length': p.height} for p in packer[0]]
+                    if VERBOSE: log(f"      > {len(recipes)} combinaciones de área válidas encontradas. Probando con el dibujante...")
+
+                    for cand in candidates:
+                        pack_key = (cut.width, cut.length, tuple(zip(imposition_sizes, cand['recipe'].values())))
+                        if pack_key not in pack_cache:
+                            # Cada trabajo se carga como un grupo de piezas con su tamaño final (con sangrado) y su índice como rid
+                            rect_groups = [(imposition_width, imposition_length, k, qty)
+                                           for k, ((imposition_width, imposition_length), qty) in enumerate(pack_key[2])]
+                            pack_cache[pack_key] = pack_on_sheet(cut.width, cut.length, rect_groups)
+
+                        packed = pack_cache[pack_key]
+                        if packed is not None:
+                            if VERBOSE: log(f"      > ÉXITO con tiraje {cand['tiraje']}: {cand['recipe']}")
+                            placements = [{'id': job_ids_in_subset[k], 'x': x, 'y': y, 'width': w, 'length': l} for k, x, y, w, l in packed]
                             champion_layouts.append({
                                 'layout_details': {'jobs': cand['recipe'], 'printing_sheet': cut},
                                 'placements': placements
                             })
+                            champion_cache[shape_key] = (job_ids_in_subset, cand['tiraje'], champion_layouts[-1])
                             break
     return champion_layouts
 
@@ -401,11 +601,11 @@ def solve_optimal_plan(data, all_jobs, base_layouts, candidate_layouts):
     for i, cand in enumerate(candidate_layouts):
         for machine in data.machines:
             cut = cand['layout_details']['printing_sheet']
-            if not (max(cut.width, cut.length) <= max(machine.maxSheetSize.width, machine.maxSheetSize.length) and \
-                    min(cut.width, cut.length) <= min(machine.maxSheetSize.width, machine.maxSheetSize.length)):
+            if not data.sheetCompatibility[(machine.id, cut.width, cut.length)]:
                 continue
             cost_info = calculate_total_layout_cost(cand['layout_details'], all_jobs, machine, data.dollarRate)
-            if cost_info:
+            # Un costo infinito (máquina sin cuerpos impresores) no puede entrar al modelo entero
+            if cost_info and math.isfinite(cost_info['total_cost']):
                 cost_info.update({
                     'layout_id': f"ganging_{i}_{machine.id}",
                     'jobs_in_layout': cand['layout_details']['jobs'],
@@ -415,79 +615,100 @@ def solve_optimal_plan(data, all_jobs, base_layouts, candidate_layouts):
 
     if not all_viable_layouts: return None
 
+    # Índices para no recorrer la lista completa de layouts en cada búsqueda
+    layouts_by_id = {l['layout_id']: l for l in all_viable_layouts}
+
+    # Columnas por layout (estructura de arrays) extraídas de los dicts en una sola pasada;
+    # el armado del modelo recorre estas listas en lugar de volver a leer cada dict
+    layout_ids = [l['layout_id'] for l in all_viable_layouts]
+    # Costos en centavos (enteros) para CP-SAT, redondeados para no alterar el orden entre costos casi iguales
+    cost_scaled = [round(l['total_cost'] * 100) for l in all_viable_layouts]
+    net_sheets = [l['net_sheets'] for l in all_viable_layouts]
+    machine_ids = [l['machine'].id for l in all_viable_layouts]
+    ps_keys = [f"{l['printing_sheet'].width}x{l['printing_sheet'].length}" for l in all_viable_layouts]
+    # *** INICIO DE LA CORRECCIÓN (KeyError) ***
+    fs_keys = [f"{l['factory_sheet_used'].width}x{l['factory_sheet_used'].length}" if 'factory_sheet_used' in l else None for l in all_viable_layouts]
+    # *** FIN DE LA CORRECCIÓN ***
+    # Transpuesta trabajo -> [(índice de layout, piezas producidas)]
+    layouts_per_job = defaultdict(list)
+    for idx, l in enumerate(all_viable_layouts):
+        for job_id, qty in l['jobs_in_layout'].items():
+            layouts_per_job[job_id].append((idx, qty * net_sheets[idx]))
+
     model = cp_model.CpModel()
     
-    use_layout_vars = {layout['layout_id']: model.NewBoolVar(f"use_{layout['layout_id']}") for layout in all_viable_layouts}
+    layout_vars = [model.NewBoolVar(f"use_{layout_id}") for layout_id in layout_ids]
+    use_layout_vars = dict(zip(layout_ids, layout_vars))
 
     for job in data.jobs:
-        produced_expr = []
-        for l in all_viable_layouts:
-            if job.id in l['jobs_in_layout']:
-                items_produced = l['jobs_in_layout'][job.id] * l['net_sheets']
-                produced_expr.append(use_layout_vars[l['layout_id']] * items_produced)
-        
-        if produced_expr:
-            model.Add(sum(produced_expr) >= job.quantity)
+        produced = layouts_per_job.get(job.id)
+        if produced:
+            model.Add(cp_model.LinearExpr.WeightedSum([layout_vars[idx] for idx, _ in produced], [items for _, items in produced]) >= job.quantity)
 
-    cost_expr = sum(use_layout_vars[l['layout_id']] * int(l['total_cost'] * 100) for l in all_viable_layouts)
+    cost_expr = cp_model.LinearExpr.WeightedSum(layout_vars, cost_scaled)
 
     machines_used = {m.id: model.NewBoolVar(f"uses_m_{m.id}") for m in data.machines}
-    ps_used = {f"{l['printing_sheet'].width}x{l['printing_sheet'].length}": model.NewBoolVar(f"uses_ps_{l['printing_sheet'].width}x{l['printing_sheet'].length}") for l in all_viable_layouts}
-    # *** INICIO DE LA CORRECCIÓN (KeyError) ***
-    fs_used = {f"{l['factory_sheet_used'].width}x{l['factory_sheet_used'].length}": model.NewBoolVar(f"uses_fs_{l['factory_sheet_used'].width}x{l['factory_sheet_used'].length}") for l in all_viable_layouts if 'factory_sheet_used' in l}
-    # *** FIN DE LA CORRECCIÓN ***
-
-    for l in all_viable_layouts:
-        model.AddImplication(use_layout_vars[l['layout_id']], machines_used[l['machine'].id])
-        ps_key = f"{l['printing_sheet'].width}x{l['printing_sheet'].length}"
-        model.AddImplication(use_layout_vars[l['layout_id']], ps_used[ps_key])
-        # *** INICIO DE LA CORRECCIÓN (KeyError) ***
-        if 'factory_sheet_used' in l:
-            fs_key = f"{l['factory_sheet_used'].width}x{l['factory_sheet_used'].length}"
-            model.AddImplication(use_layout_vars[l['layout_id']], fs_used[fs_key])
-        # *** FIN DE LA CORRECCIÓN ***
-
-    num_machines = model.NewIntVar(0, len(machines_used), 'num_machines')
-    model.Add(num_machines == sum(machines_used.values()))
-    num_ps = model.NewIntVar(0, len(ps_used), 'num_ps')
-    model.Add(num_ps == sum(ps_used.values()))
-    num_fs = model.NewIntVar(0, len(fs_used), 'num_fs')
-    model.Add(num_fs == sum(fs_used.values()))
-
-    total_cost_var = model.NewIntVar(0, 100000000000, 'total_cost_var')
+    ps_used = {key: model.NewBoolVar(f"uses_ps_{key}") for key in ps_keys}
+    fs_used = {key: model.NewBoolVar(f"uses_fs_{key}") for key in fs_keys if key is not None}
+
+    for var, machine_id, ps_key, fs_key in zip(layout_vars, machine_ids, ps_keys, fs_keys):
+        model.AddImplication(var, machines_used[machine_id])
+        model.AddImplication(var, ps_used[ps_key])
+        if fs_key is not None:
+            model.AddImplication(var, fs_used[fs_key])
+
+    # Cotas ajustadas: el costo total no puede superar el de usar todos los layouts a la vez
+    max_total_cost = sum(cost_scaled)
+    total_cost_var = model.NewIntVar(0, max_total_cost, 'total_cost_var')
     model.Add(total_cost_var == cost_expr)
 
-    machine_penalty_product = model.NewIntVar(-100000000000, 100000000000, 'machine_prod')
-    model.AddMultiplicationEquality(machine_penalty_product, total_cost_var, num_machines - 1)
-    
-    ps_penalty_product = model.NewIntVar(-100000000000, 100000000000, 'ps_prod')
-    model.AddMultiplicationEquality(ps_penalty_product, total_cost_var, num_ps - 1)
+    # total_cost * (num_usados - 1) linealizado como sum(costo_si_usado) - total_cost, donde cada
+    # costo_si_usado vale total_cost si el recurso se usa y 0 si no. Con penalización >= 0 alcanza con la cota
+    # inferior reificada: el objetivo (minimización) ya lleva costo_si_usado a 0 o a total_cost
+    def cost_times_count_minus_one(used_vars, prefix, penalty):
+        terms = []
+        for key, used in used_vars.items():
+            cost_if_used = model.NewIntVar(0, max_total_cost, f"{prefix}_cost_{key}")
+            model.Add(cost_if_used >= total_cost_var).OnlyEnforceIf(used)
+            if penalty < 0:
+                # Una penalización negativa empujaría costo_si_usado hacia arriba: se fija el valor exacto
+                model.Add(cost_if_used <= total_cost_var).OnlyEnforceIf(used)
+                model.Add(cost_if_used == 0).OnlyEnforceIf(used.Not())
+            terms.append(cost_if_used)
+        return sum(terms) - total_cost_var
 
-    fs_penalty_product = model.NewIntVar(-100000000000, 100000000000, 'fs_prod')
-    model.AddMultiplicationEquality(fs_penalty_product, total_cost_var, num_fs - 1)
-    
     penalties = data.options.penalties
+    machine_penalty_product = cost_times_count_minus_one(machines_used, 'machine', penalties.differentMachinePenalty)
+    ps_penalty_product = cost_times_count_minus_one(ps_used, 'ps', penalties.differentPressSheetPenalty)
+    fs_penalty_product = cost_times_count_minus_one(fs_used, 'fs', penalties.differentFactorySheetPenalty)
     
-    machine_penalty_scaled = model.NewIntVar(-100000000000, 100000000000, 'machine_penalty_scaled')
-    model.AddDivisionEquality(machine_penalty_scaled, machine_penalty_product * penalties.differentMachinePenalty, 100)
-
-    ps_penalty_scaled = model.NewIntVar(-100000000000, 100000000000, 'ps_penalty_scaled')
-    model.AddDivisionEquality(ps_penalty_scaled, ps_penalty_product * penalties.differentPressSheetPenalty, 100)
-
-    fs_penalty_scaled = model.NewIntVar(-100000000000, 100000000000, 'fs_penalty_scaled')
-    model.AddDivisionEquality(fs_penalty_scaled, fs_penalty_product * penalties.differentFactorySheetPenalty, 100)
-    
-    total_penalty_cost = model.NewIntVar(-300000000000, 300000000000, 'total_penalty_cost')
-    model.Add(total_penalty_cost == machine_penalty_scaled + ps_penalty_scaled + fs_penalty_scaled)
-    
-    model.Minimize(total_cost_var + total_penalty_cost)
+    # Las penalizaciones son porcentajes: en lugar de dividir cada una por 100 (AddDivisionEquality)
+    # se escala el objetivo completo x100, que deja el modelo totalmente lineal
+    model.Minimize(100 * total_cost_var
+                   + penalties.differentMachinePenalty * machine_penalty_product
+                   + penalties.differentPressSheetPenalty * ps_penalty_product
+                   + penalties.differentFactorySheetPenalty * fs_penalty_product)
     # --- #cambio1: Bucle iterativo para buscar múltiples soluciones ---
     # Se reemplaza la llamada única al solver con un bucle que busca
     # soluciones progresivamente peores, guardando cada una.
+    # Se usa un único CpSolver configurado una sola vez; entre búsquedas solo cambia la cota
+    # del costo y cada búsqueda arranca con la solución anterior como hint.
+    solver = cp_model.CpSolver()
+    # Parámetros ajustados a este modelo (booleanos de uso de layout + productos con el costo total):
+    # linealización completa, sin detección de simetrías (los layouts no son intercambiables) y probing liviano
+    # Un worker por CPU disponible: en instancias de 1-2 vCPU más workers solo compiten por el mismo núcleo
+    solver.parameters.num_workers = os.cpu_count() or 1
+    solver.parameters.linearization_level = 2
+    solver.parameters.symmetry_level = 0
+    solver.parameters.cp_model_probing_level = 1
+    solver.parameters.log_search_progress = os.environ.get('OPTIMIZER_SOLVER_LOG', '') == '1'
+
+    # La solución base (un layout individual por trabajo) es factible: se da como punto de partida
+    for l in base_layouts:
+        model.AddHint(use_layout_vars[l['layout_id']], 1)
     
     found_solutions = []
     for i in range(data.options.numberOfSolutions):
-        solver = cp_model.CpSolver()
         status = solver.Solve(model)
 
         if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
@@ -498,7 +719,7 @@ def solve_optimal_plan(data, all_jobs, base_layouts, candidate_layouts):
             plan = []
             for l_id, v_var in use_layout_vars.items():
                 if solver.Value(v_var) == 1:
-                    layout_obj = next((l for l in all_viable_layouts if l['layout_id'] == l_id), None)
+                    layout_obj = layouts_by_id.get(l_id)
                     if layout_obj:
                         plan.append({
                             'id': l_id,
@@ -506,7 +727,7 @@ def solve_optimal_plan(data, all_jobs, base_layouts, candidate_layouts):
                             'costForThisPlanItem': round(layout_obj['total_cost'], 2)
                         })
             
-            layouts_in_plan = {l['layout_id']: l for l in all_viable_layouts if l['layout_id'] in [p['id'] for p in plan]}
+            layouts_in_plan = {p['id']: layouts_by_id[p['id']] for p in plan}
             
             found_solutions.append({
                 'summary': {'gangedTotalCost': cost / 100},
@@ -517,6 +738,9 @@ def solve_optimal_plan(data, all_jobs, base_layouts, candidate_layouts):
             # --- #cambio3: Añadir restricción para la siguiente búsqueda ---
             # Se añade una restricción para que la próxima solución sea
             # estrictamente más cara que la que acabamos de encontrar.
+            model.ClearHints()
+            for v_var in use_layout_vars.values():
+                model.AddHint(v_var, solver.Value(v_var))
             model.Add(total_cost_var > cost)
 
         else:
@@ -580,9 +804,24 @@ def parse_input_data(raw_data):
         jobs=jobs,
         machines=machines,
         availableCuts=available_cuts,
-        dollarRate=raw_data['commonDetails']['dollarRate'] # <--- ESTA ES LA LÍNEA QUE FALTA
+        dollarRate=raw_data['commonDetails']['dollarRate'], # <--- ESTA ES LA LÍNEA QUE FALTA
+        sheetCompatibility=build_sheet_compatibility(machines, available_cuts)
     )
 
+def build_sheet_compatibility(machines, available_cuts):
+    """
+    Precalcula, para cada máquina y cada tamaño de pliego disponible, si el pliego entra en el
+    tamaño máximo de la máquina (lado mayor contra lado mayor y menor contra menor), con una sola
+    comparación vectorizada máquinas x pliegos.
+    """
+    sizes = list(dict.fromkeys((s.width, s.length) for cut_map in available_cuts for s in cut_map.sheetSizes))
+    if not machines or not sizes: return {}
+    sheet_dims = np.array(sizes)
+    machine_dims = np.array([(m.maxSheetSize.width, m.maxSheetSize.length) for m in machines])
+    compat = (sheet_dims.max(axis=1)[None, :] <= machine_dims.max(axis=1)[:, None]) & \
+             (sheet_dims.min(axis=1)[None, :] <= machine_dims.min(axis=1)[:, None])
+    return {(m.id, w, l): bool(compat[i, j]) for i, m in enumerate(machines) for j, (w, l) in enumerate(sizes)}
+
 def format_layout_for_output(layout_obj):
     """Formatea un objeto de layout para el JSON de salida."""
     if not layout_obj: return {}
@@ -598,23 +837,53 @@ def format_layout_for_output(layout_obj):
         "placements": layout_obj.get('placements')
     }
 
+# Último timestamp formateado y el segundo al que corresponde: log() se llama varias veces por segundo
+# y solo hace falta volver a formatear la hora cuando cambia el segundo
+_log_timestamp = ['', None]
+
 def log(message):
     """Imprime un mensaje con timestamp."""
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
+    now = int(time.time())
+    if now != _log_timestamp[1]:
+        _log_timestamp[:] = [time.strftime('%H:%M:%S', time.localtime(now)), now]
+    print(f"[{_log_timestamp[0]}] {message}")
 
 
 def main(input_path):
     log(f"Iniciando optimizador con el archivo: {input_path}")
     try:
-        with open(input_path, 'r', encoding='utf-8-sig') as f:
-            raw_data = json.load(f)
-    except json.JSONDecodeError as e:
+        if orjson is not None:
+            # orjson parsea en C; no acepta el BOM de UTF-8, así que se quita a mano (equivale a 'utf-8-sig')
+            with open(input_path, 'rb') as f:
+                raw_bytes = f.read()
+            raw_data = orjson.loads(raw_bytes.removeprefix(b'\xef\xbb\xbf'))
+        else:
+            with open(input_path, 'r', encoding='utf-8-sig') as f:
+                raw_data = json.load(f)
+    except json.JSONDecodeError as e:  # orjson.JSONDecodeError hereda de json.JSONDecodeError
         log(f"ERROR: El archivo '{input_path}' está vacío o no es un JSON válido. Detalles: {e}")
         return
     except FileNotFoundError:
         log(f"ERROR: No se encontró el archivo '{input_path}'.")
         return
 
+    output = optimize(raw_data)
+
+    output_filename = "/tmp/output.json"
+    if orjson is not None:
+        # orjson serializa los dataclasses y los arrays de numpy en C, sin recorrer el árbol en Python
+        with open(output_filename, 'wb') as f:
+            f.write(orjson.dumps(output, default=str,
+                                 option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            def custom_serializer(o): return dataclasses.asdict(o) if dataclasses.is_dataclass(o) else str(o)
+            json.dump(output, f, ensure_ascii=False, indent=2, default=custom_serializer)
+    log("Proceso completado. La solución está en 'output.json'.")
+
+
+def optimize(raw_data):
+    """Ejecuta el optimizador en memoria: recibe el input ya parseado y devuelve el output como dict."""
     data = parse_input_data(raw_data)
     all_jobs_map = {job.id: job for job in data.jobs}
 
@@ -651,65 +920,9 @@ def main(input_path):
             log("No se encontraron soluciones de ganging que mejoren la base.")
     else:
         log("No se encontró ninguna solución de ganging.")
-    
-    output_filename = "/tmp/output.json"
-    with open(output_filename, 'w', encoding='utf-8') as f:
-        def custom_serializer(o): return o.__dict__ if hasattr(o, '__dict__') else str(o)
-        json.dump(output, f, ensure_ascii=False, indent=2, default=custom_serializer)
-    log("Proceso completado. La solución está en 'output.json'.")
-
-# AHORA (Corregido)
-'''def align_placements(placements, threshold=5):
-    """
-    Post-procesa los placements para forzar la alineación en una grilla,
-    MOVIENDO los trabajos sin cambiar su tamaño.
-    """
-    if not placements:
-        return []
-
-    # 1. Recolectar solo las coordenadas de INICIO (x, y)
-    x_coords = set(p['x'] for p in placements)
-    y_coords = set(p['y'] for p in placements)
 
-    sorted_x = sorted(list(x_coords))
-    sorted_y = sorted(list(y_coords))
+    return output
 
-    # 2. Agrupar (cluster) coordenadas cercanas para encontrar las "líneas maestras"
-    def cluster_coords(coords):
-        if not coords: return {}
-        clusters = []
-        current_cluster = [coords[0]]
-        for i in range(1, len(coords)):
-            if coords[i] - current_cluster[-1] <= threshold:
-                current_cluster.append(coords[i])
-            else:
-                clusters.append(current_cluster)
-                current_cluster = [coords[i]]
-        clusters.append(current_cluster)
-        
-        coord_map = {}
-        for cluster in clusters:
-            master_coord = min(cluster)
-            for c in cluster:
-                coord_map[c] = master_coord
-        return coord_map
-
-    x_map = cluster_coords(sorted_x)
-    y_map = cluster_coords(sorted_y)
-
-    # 3. Generar la nueva lista de placements moviendo los trabajos SIN cambiar su tamaño
-    aligned = []
-    for p in placements:
-        aligned.append({
-            'id': p['id'],
-            'x': x_map.get(p['x'], p['x']),      # Se MUEVE la coordenada X a la línea maestra
-            'y': y_map.get(p['y'], p['y']),      # Se MUEVE la coordenada Y a la línea maestra
-            'width': p['width'],                # Se MANTIENE el ancho original
-            'length': p['length']               # Se MANTIENE el largo original
-        })
-
-    return aligned
-'''
 def align_placements(placements, threshold=5):
     """
     Post-procesa los placements para forzar la alineación en una grilla,